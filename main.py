@@ -2,21 +2,18 @@ from __future__ import annotations
 
 import argparse
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 
-import pytz
-from dotenv import dotenv_values
-
-from config import BOOKING_OPEN_TIME
-from src.booker import Booker
-from src.lane import Lane
 from src.log import get_logger
 
+LONDON_TZ = ZoneInfo("Europe/London")
+
 
 def main():
     logger = get_logger("main", __name__, level=logging.DEBUG)
-    today = datetime.now().astimezone(pytz.timezone("Europe/London"))
-    logger.info(f"Local time now is {today}.")
+    today = datetime.now(LONDON_TZ)
+    logger.info("Local time now is %s.", today)
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -30,7 +27,8 @@ def main():
         "--lane",
         metavar="LANE",
         type=str,
-        choices=[l.name for l in Lane],
+        # Kept in sync with src.lane.Lane by hand so --help doesn't import it.
+        choices=["SLOW", "MEDIUM", "FAST"],
         default="MEDIUM",
         help="Desired lane to swim in. One of SLOW, MEDIUM, or FAST. Default = MEDIUM.",
     )
@@ -42,6 +40,14 @@ def main():
         default=8,
         help="How many days forward to book for, by default 8.",
     )
+    parser.add_argument(
+        "-s",
+        "--scan-days",
+        metavar="N",
+        type=int,
+        default=1,
+        help="How many consecutive days, starting from --days-ahead, to look for a matching slot in. Default = 1.",
+    )
     parser.add_argument(
         "-e",
         "--env",
@@ -50,6 +56,18 @@ def main():
         default=".env",
         help="Path to .env file containing authentication information. Defaults to .env",
     )
+    parser.add_argument(
+        "--prewarm-seconds",
+        metavar="N",
+        type=int,
+        default=0,
+        help="If run within N seconds before BOOKING_OPEN_TIME, logs in and keeps the connection warm until booking opens instead of skipping. Default = 0.",
+    )
+    parser.add_argument(
+        "--fast-login",
+        action="store_true",
+        help="If set, reads the login config from the session instead of scraping it. Falls back to scraping if that fails.",
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
@@ -57,15 +75,41 @@ def main():
     )
 
     args = parser.parse_args()
-    logger.debug(f"Parsed args={args}")
+    logger.debug("Parsed args=%s", args)
+
+    from config import BOOKING_OPEN_TIME
 
-    if today.hour != BOOKING_OPEN_TIME and not args.dry_run:
-        logger.warning(f"{today.hour} != {BOOKING_OPEN_TIME}. Skipping...")
+    opens_at = today.replace(hour=BOOKING_OPEN_TIME, minute=0, second=0, microsecond=0)
+    if opens_at < today:
+        opens_at += timedelta(days=1)
+    prewarm = 0 < (opens_at - today).total_seconds() <= args.prewarm_seconds
+
+    if today.hour != BOOKING_OPEN_TIME and not args.dry_run and not prewarm:
+        logger.warning("%d != %d. Skipping...", today.hour, BOOKING_OPEN_TIME)
         return
 
+    # Deferred so that --help and the skip above don't pay for importing the HTTP /
+    # parsing stack.
+    from dotenv import dotenv_values
+
+    from src.booker import Booker
+    from src.lane import Lane
+
     env = dotenv_values(args.env)
-    booker = Booker(env["EMAIL"], env["PASSWORD"])
-    booker.book(args.start_time, lane=Lane[args.lane], days_ahead=args.days_ahead)
+    booker = Booker(env["EMAIL"], env["PASSWORD"], fast_login=args.fast_login)
+    if prewarm and not args.dry_run:
+        if args.scan_days > 1:
+            logger.warning(
+                "--scan-days > 1 searches over a separate connection pool, so only "
+                "the login and the checkout benefit from --prewarm-seconds."
+            )
+        booker.prewarm_until(opens_at)
+    booker.book(
+        args.start_time,
+        lane=Lane[args.lane],
+        days_ahead=args.days_ahead,
+        scan_days=args.scan_days,
+    )
 
 
 if __name__ == "__main__":
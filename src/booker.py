@@ -1,42 +1,95 @@
-import json
+import asyncio
 import logging
 import re
+import time
 from datetime import datetime, timedelta
-from functools import cached_property
+from typing import Optional
+from zoneinfo import ZoneInfo
 
-import pytz
-import requests
-from bs4 import BeautifulSoup
+import httpx
+import ijson
+import orjson
+import config
 from config import API_URL, APP_ID, APP_KEY
-from requests.exceptions import HTTPError
+from selectolax.lexbor import LexborHTMLParser
 
+from src._cached import cached_property
 from src.errors import LoginError, NoSlotsAvailable
 from src.lane import Lane
 from src.log import get_logger
+from src.token_cache import TokenCache
+from src.transport import RETRY_EXTENSION, AsyncRetryTransport, RetryTransport
+
+LONDON_TZ = ZoneInfo("Europe/London")
+JSON_HEADERS = {"Content-Type": "application/json"}
+SCRIPT_RE = re.compile(
+    rb"<script[^>]*\bdata-container\b[^>]*>(.*?)</script>", re.DOTALL
+)
+SETTINGS_RE = re.compile(rb"var SETTINGS = (.*);")
+EVENTS_PREFIX = "_embedded.events.item"
+CSRF_COOKIE = "x-ms-cpim-csrf"
+TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+LIMITS = httpx.Limits(max_connections=8, max_keepalive_connections=8)
+
+log = get_logger("Booker", __name__, level=logging.DEBUG)
 
 
 class Booker(object):
-    def __init__(self, email: str, password: str):
-        self.session = requests.Session()
+    def __init__(self, email: str, password: str, fast_login: bool = False):
+        self.session = httpx.Client(
+            headers={"App-Id": APP_ID, "App-Key": APP_KEY},
+            timeout=TIMEOUT,
+            follow_redirects=True,
+            # The client ignores its own http2 / limits arguments once given a
+            # transport, so they are set on the transport instead.
+            transport=RetryTransport(http2=True, limits=LIMITS),
+        )
         self.email = email
         self.password = password
-        self.session.headers.update({"App-Id": APP_ID, "App-Key": APP_KEY})
+        self.fast_login = fast_login
+        self._token_cache = TokenCache()
+        self._authenticate()
+
+    def _authenticate(self) -> None:
+        logger = log.getChild("_authenticate")
+        cached = self._token_cache.load(self.email)
+        self._is_cached_token = cached is not None
+        if self._is_cached_token:
+            logger.debug("Reusing cached auth token, skipping login...")
+            # cached_property stores its value in the instance dict, so pre-populating
+            # it here short-circuits the whole _sso_token -> _login chain.
+            self.__dict__["_sso_token"] = cached["auth_token"]
+            self.__dict__["_member_id"] = cached["member_id"]
+        else:
+            self._token_cache.save(self.email, self._sso_token, self._member_id)
         self.session.headers.update({"Auth-Token": self._sso_token})
 
-    def _post(self, endpoint, exception_msg="POST request failed.", **kwargs):
-        logger = get_logger("Booker._post", __name__, level=logging.DEBUG)
+    def _reauthenticate(self) -> None:
+        logger = log.getChild("_reauthenticate")
+        logger.warning("Cached auth token was rejected, logging in again...")
+        self._token_cache.invalidate()
+        for attr in ("_auth_info", "_login_config", "_member_id", "_sso_token"):
+            self.__dict__.pop(attr, None)
+        self._authenticate()
+
+    def _post(
+        self, endpoint, exception_msg="POST request failed.", stream=False, **kwargs
+    ):
+        logger = log.getChild("_post")
         kwargs_str = (
             "..."
             if not kwargs
             else f' with {", ".join(f"{k}={v}" for k, v in kwargs.items())}...'
         )
-        logger.debug(f"Sending a POST request to {endpoint}{kwargs_str}")
-        res = self.session.post(endpoint, **kwargs)
+        logger.debug("Sending a POST request to %s%s", endpoint, kwargs_str)
+        request = self.session.build_request("POST", endpoint, **kwargs)
+        res = self.session.send(request, stream=stream)
 
         try:
             res.raise_for_status()
-        except HTTPError as err:
+        except httpx.HTTPStatusError as err:
             logger.exception(exception_msg)
+            res.close()
             raise err
 
         return res
@@ -47,32 +100,66 @@ class Booker(object):
 
     @cached_property
     def _auth_info(self) -> dict:
-        logger = get_logger("Booker._auth_info", __name__, level=logging.DEBUG)
+        logger = log.getChild("_auth_info")
         token, company_id = self._login(self.email, self.password)
         url = f"{API_URL}/login/sso/{company_id}"
         res = self._post(
             url, exception_msg="Failed to retrieve auth_info.", data={"token": token}
         )
-        auth_info = json.loads(res.content)
-        logger.debug(f"Got auth_info={auth_info}")
+        auth_info = orjson.loads(res.content)
+        logger.debug("Got auth_info=%s", auth_info)
         return auth_info
 
     @cached_property
     def _login_config(self) -> dict:
-        logger = get_logger("Booker._login_config", __name__, level=logging.DEBUG)
+        logger = log.getChild("_login_config")
         logger.debug(
             "Sending a GET request to https://www.nuffieldhealth.com/account/idaaslogin"
         )
         res = self.session.get("https://www.nuffieldhealth.com/account/idaaslogin")
-        soup = BeautifulSoup(res.text, "lxml")
+        if self.fast_login:
+            if login_config := self._login_config_from_session(res):
+                logger.debug("Got login config from session, skipping scrape.")
+                return login_config
+            logger.warning("Fast login unavailable, falling back to scraping...")
         logger.debug("Attempting to scrape login config from returned page...")
-        data_container = soup.find("script", {"data-container": True}).string
-        if not (settings := re.search(r"var SETTINGS = (.*);", data_container)):
+        script = SCRIPT_RE.search(res.content)
+        if not script or not (settings := SETTINGS_RE.search(script.group(1))):
             message = "Unable to scrape login config!"
             logger.error(message)
             raise LoginError(message)
         logger.debug("Successfully scraped login config.")
-        return json.loads(settings.group(1))
+        return orjson.loads(settings.group(1))
+
+    def _login_config_from_session(self, res: httpx.Response) -> Optional[dict]:
+        """Builds the login config without scraping the login page.
+
+        The CSRF token is read from the cookie set by the identity provider, and the
+        transaction id from the `tx` query parameter of the (redirected) login URL.
+        The tenant, policy and API are fixed for this integration and come from
+        config.py. Returns None if any of these values is missing, or if the CSRF
+        cookie is ambiguous.
+        """
+        tenant = getattr(config, "LOGIN_TENANT", None)
+        policy = getattr(config, "LOGIN_POLICY", None)
+        api = getattr(config, "LOGIN_API", None)
+        if not (tenant and policy and api):
+            return None
+        try:
+            csrf = self.session.cookies.get(CSRF_COOKIE)
+        except httpx.CookieConflict:
+            return None
+        trans_ids = [
+            tx for r in (*res.history, res) for tx in r.url.params.get_list("tx")
+        ]
+        if not csrf or not trans_ids:
+            return None
+        return {
+            "csrf": csrf,
+            "transId": trans_ids[-1],
+            "hosts": {"tenant": tenant, "policy": policy},
+            "api": api,
+        }
 
     @cached_property
     def _member_id(self) -> int:
@@ -83,65 +170,168 @@ class Booker(object):
         return self._auth_info["auth_token"]
 
     @staticmethod
-    def _transform(slot: dict) -> dict:
-        start_time = datetime.strptime(slot["datetime"], "%Y-%m-%dT%H:%M:%S%z")
-        lane = slot["description"].split(" ", 1)[0].upper()
-        return {
-            "start_time": int(f"{start_time.hour:d}{start_time.minute:02d}"),
-            "lane": Lane.get(lane),
-            "event_id": slot["id"],
-            "event_chain_id": slot["event_chain_id"],
-        }
+    def _matches(event: dict, lane: Lane, start_time: int) -> bool:
+        # event["datetime"] is always formatted as %Y-%m-%dT%H:%M:%S%z, and we only
+        # need the hour and minute out of it.
+        event_time = event["datetime"]
+        hour, minute = int(event_time[11:13]), int(event_time[14:16])
+        if hour * 100 + minute != start_time:
+            return False
+        return Lane.get(event["description"].split(" ", 1)[0].upper()) is lane
 
     def _checkout(self, slot: dict) -> None:
-        logger = get_logger("Booker._checkout", __name__, level=logging.DEBUG)
-        logger.info(f"Checking out {slot}...")
+        logger = log.getChild("_checkout")
+        logger.info("Checking out %s...", slot)
+
+        # Serialise both bodies up front so nothing but network I/O sits between the
+        # two requests.
+        add_item_data = orjson.dumps({"entire_basket": True, "items": [slot]})
+        checkout_data = orjson.dumps({"client": {"id": self._member_id}})
 
         endpoint = f"{self._api_url}/basket/add_item"
-        data = {"entire_basket": True, "items": [slot]}
-        self._post(endpoint, exception_msg="Failed to add slot to basket.", json=data)
+        res = self._post(
+            endpoint,
+            exception_msg="Failed to add slot to basket.",
+            content=add_item_data,
+            headers=JSON_HEADERS,
+            stream=True,
+        )
+        Booker._discard(res)
 
         endpoint = f"{self._api_url}/basket/checkout"
-        data = {"client": {"id": self._member_id}}
-        self._post(endpoint, exception_msg="Failed to checkout basket.", json=data)
-
-    def _get_first_matching(self, slots: list, lane: Lane, start_time: int) -> dict:
-        logger = get_logger("Booker._get_first_matching", __name__, level=logging.DEBUG)
-        first_matching_slot = next(
-            {
-                "event_id": slot["event_id"],
-                "event_chain_id": slot["event_chain_id"],
-                "member_id": self._member_id,
-            }
-            for slot in slots
-            if slot["lane"] == lane and slot["start_time"] == start_time
-        )
-        logger.info(
-            f"{first_matching_slot} matches lane={lane} and start_time={start_time}"
+        res = self._post(
+            endpoint,
+            exception_msg="Failed to checkout basket.",
+            content=checkout_data,
+            headers=JSON_HEADERS,
+            stream=True,
         )
-        return first_matching_slot
+        Booker._discard(res)
 
-    def _get_slots_for(self, target_date: datetime) -> list:
-        logger = get_logger("Booker._get_slots_for", __name__, level=logging.DEBUG)
-        date_str = target_date.strftime("%Y-%m-%d")
-        logger.info(f"Retrieving slots for {date_str}...")
-        params = {
+    @staticmethod
+    def _discard(res: httpx.Response) -> None:
+        # Drop the unread body of a streamed response without buffering it. Over
+        # HTTP/1.1 this lets the connection go back to the pool instead of being
+        # closed.
+        if not res.is_stream_consumed:
+            for _ in res.iter_raw():
+                pass
+        res.close()
+
+    @staticmethod
+    def _events_params(date_str: str) -> dict:
+        return {
             "start_date": date_str,
             "end_date": date_str,
-            "include_non_bookable": False,
+            # httpx would encode a bool as "false", keep sending what requests did.
+            "include_non_bookable": "False",
         }
+
+    def _to_slot(self, event: dict) -> dict:
+        return {
+            "event_id": event["id"],
+            "event_chain_id": event["event_chain_id"],
+            "member_id": self._member_id,
+        }
+
+    def _first_match(self, events: list, lane: Lane, start_time: int) -> Optional[dict]:
+        slot = next(
+            (self._to_slot(e) for e in events if Booker._matches(e, lane, start_time)),
+            None,
+        )
+        del events[:]
+        return slot
+
+    @staticmethod
+    def _events_parser() -> tuple:
+        """Returns an ijson coroutine to send chunks to, and the list it fills"""
+        events = ijson.sendable_list()
+        return ijson.items_coro(events, EVENTS_PREFIX, use_float=True), events
+
+    def _find_slot(
+        self, target_date: datetime, lane: Lane, start_time: int
+    ) -> Optional[dict]:
+        """Streams the events for `target_date`, returning the first matching slot.
+
+        The response is parsed incrementally, so we stop parsing as soon as a match
+        is found. Returns None if no event matches.
+        """
+        logger = log.getChild("_find_slot")
+        date_str = target_date.strftime("%Y-%m-%d")
+        logger.info("Retrieving slots for %s...", date_str)
+        params = Booker._events_params(date_str)
         endpoint = f"{self._api_url}/events"
-        logger.debug(f"Sending a GET request to {endpoint} with params={params}")
-        res = self.session.get(endpoint, params=params)
-        slots = [
-            Booker._transform(slot)
-            for slot in json.loads(res.content)["_embedded"]["events"]
-        ]
-        logger.info(f"Found {len(slots)} available slots for {date_str}.")
-        return slots
+        logger.debug("Sending a GET request to %s with params=%s", endpoint, params)
+        with self.session.stream("GET", endpoint, params=params) as res:
+            res.raise_for_status()
+            parser, events = Booker._events_parser()
+            chunks = res.iter_bytes()
+            for chunk in chunks:
+                parser.send(chunk)
+                if slot := self._first_match(events, lane, start_time):
+                    break
+            else:
+                parser.close()
+                slot = self._first_match(events, lane, start_time)
+            # Discard the rest of the body unparsed so an HTTP/1.1 connection can go
+            # back to the pool for checkout.
+            for _ in chunks:
+                pass
+
+        if slot is None:
+            logger.info("No matching slots found for %s.", date_str)
+        else:
+            logger.info("%s matches on %s.", slot, date_str)
+        return slot
+
+    async def _find_slot_async(
+        self,
+        session: httpx.AsyncClient,
+        target_date: datetime,
+        lane: Lane,
+        start_time: int,
+    ) -> Optional[dict]:
+        logger = log.getChild("_find_slot_async")
+        date_str = target_date.strftime("%Y-%m-%d")
+        logger.info("Retrieving slots for %s...", date_str)
+        params = Booker._events_params(date_str)
+        endpoint = f"{self._api_url}/events"
+        logger.debug("Sending a GET request to %s with params=%s", endpoint, params)
+        async with session.stream("GET", endpoint, params=params) as res:
+            res.raise_for_status()
+            parser, events = Booker._events_parser()
+            async for chunk in res.aiter_bytes():
+                parser.send(chunk)
+                if slot := self._first_match(events, lane, start_time):
+                    break
+            else:
+                parser.close()
+                slot = self._first_match(events, lane, start_time)
+
+        if slot is None:
+            logger.info("No matching slots found for %s.", date_str)
+        else:
+            logger.info("%s matches on %s.", slot, date_str)
+        return slot
+
+    async def _scan(self, target_dates: list, lane: Lane, start_time: int) -> list:
+        async with httpx.AsyncClient(
+            headers=self.session.headers,
+            timeout=TIMEOUT,
+            transport=AsyncRetryTransport(http2=True, limits=LIMITS),
+        ) as session:
+            # One day failing shouldn't throw away a match found on another, so
+            # errors are returned here and dealt with in _book.
+            return await asyncio.gather(
+                *(
+                    self._find_slot_async(session, d, lane, start_time)
+                    for d in target_dates
+                ),
+                return_exceptions=True,
+            )
 
     def _login(self, email: str, password: str) -> tuple:
-        logger = get_logger("Booker._login", __name__, level=logging.DEBUG)
+        logger = log.getChild("_login")
 
         logger.debug("Updating session headers with scraped CSRF token...")
         self.session.headers.update({"X-CSRF-TOKEN": self._login_config["csrf"]})
@@ -157,21 +347,65 @@ class Booker(object):
 
         params.update({"csrf_token": self._login_config.get("csrf")})
         endpoint = f"{base_url}/api/{self._login_config['api']}/confirmed"
-        logger.debug(f"Sending a GET request to {endpoint} with params={params}")
+        logger.debug("Sending a GET request to %s with params=%s", endpoint, params)
         res = self.session.get(endpoint, params=params)
 
-        soup = BeautifulSoup(res.text, "lxml")
-        endpoint = soup.find("form", id="auto").get("action")
-        data = {"code": soup.find("input", id="code").get("value")}
+        tree = LexborHTMLParser(res.text)
+        endpoint = tree.css_first("form#auto").attributes["action"]
+        data = {"code": tree.css_first("input#code").attributes["value"]}
         res = self._post(endpoint, data=data)
 
-        soup = BeautifulSoup(res.text, "lxml")
-        api_auth_info = soup.find("div", {"member-sso-login": True, "company-id": True})
-        logger.info(f"Sucessfully logged in as {email}.")
+        tree = LexborHTMLParser(res.text)
+        api_auth_info = tree.css_first("div[member-sso-login][company-id]")
+        logger.info("Sucessfully logged in as %s.", email)
 
-        return api_auth_info.get("member-sso-login"), api_auth_info.get("company-id")
+        return (
+            api_auth_info.attributes["member-sso-login"],
+            api_auth_info.attributes["company-id"],
+        )
+
+    def prewarm_until(self, deadline: datetime, interval: float = 10.0) -> None:
+        """Keeps the connection to the API host warm until `deadline`.
+
+        Sends a HEAD request to the API every `interval` seconds, so that the booking
+        requests fired at `deadline` reuse an already open TCP / TLS connection.
+        Pings are never retried, and time out before `deadline`, so a slow or failing
+        API can't hold up the booking.
+
+        Only the sync session is kept warm. A multi-day `book(..., scan_days=n)` looks
+        up slots over its own async client, so there just the checkout reuses the
+        warm connection.
+
+        Parameters
+        ----------
+        deadline : datetime
+            Timezone-aware time to block until.
+        interval : float, optional
+            Seconds between keep-alive requests, by default 10.0
+        """
+        logger = log.getChild("prewarm_until")
+        logger.info("Keeping connection to %s warm until %s...", API_URL, deadline)
+        last_ping = float("-inf")
+        while (remaining := (deadline - datetime.now(LONDON_TZ)).total_seconds()) > 0:
+            if time.monotonic() - last_ping >= interval:
+                last_ping = time.monotonic()
+                try:
+                    self.session.head(
+                        self._api_url,
+                        timeout=min(remaining, TIMEOUT.read),
+                        extensions={RETRY_EXTENSION: False},
+                    )
+                except httpx.RequestError:
+                    logger.debug("Keep-alive request failed.", exc_info=True)
+            time.sleep(0.05)
 
-    def book(self, start: int, lane: Lane = Lane.MEDIUM, days_ahead: int = 8) -> None:
+    def book(
+        self,
+        start: int,
+        lane: Lane = Lane.MEDIUM,
+        days_ahead: int = 8,
+        scan_days: int = 1,
+    ) -> None:
         """Books a swimming slot according to the specified filters.
 
         Parameters
@@ -182,22 +416,54 @@ class Booker(object):
             Desired lane to swim in, by default Lane.MEDIUM
         days_ahead : int, optional
             How many days forward to book for, by default 8
+        scan_days : int, optional
+            How many consecutive days, starting from `days_ahead`, to look for a
+            matching slot in. The first day with a match is booked. By default 1
 
         Raises
         ------
         NoSlotsAvailable
             When the specified filters are too narrow.
         """
-        logger = get_logger("Booker.book", __name__)
-        today = datetime.now().astimezone(pytz.timezone("Europe/London"))
-        target_date = today + timedelta(days=days_ahead)
-        logger.info(f"Booking slot with start={start} and lane={lane} on {target_date}")
+        logger = log.getChild("book")
+        today = datetime.now(LONDON_TZ)
+        target_dates = [
+            today + timedelta(days=days_ahead + i) for i in range(max(scan_days, 1))
+        ]
+        logger.info(
+            "Booking slot with start=%s and lane=%s on %s",
+            start,
+            lane,
+            ", ".join(str(d.date()) for d in target_dates),
+        )
 
-        slots = self._get_slots_for(target_date)
         try:
-            slot = self._get_first_matching(slots, lane, start)
+            self._book(target_dates, lane, start)
+        except httpx.HTTPStatusError as err:
+            if not self._is_cached_token or err.response.status_code != 401:
+                raise err
+            self._reauthenticate()
+            self._book(target_dates, lane, start)
+
+    def _book(self, target_dates: list, lane: Lane, start: int) -> None:
+        if len(target_dates) == 1:
+            slots = [self._find_slot(target_dates[0], lane, start)]
+        else:
+            slots = asyncio.run(self._scan(target_dates, lane, start))
+
+        errors = [s for s in slots if isinstance(s, Exception)]
+        slot = next((s for s in slots if isinstance(s, dict)), None)
+        if slot is not None:
+            if errors:
+                log.getChild("_book").warning(
+                    "Ignoring %d failed day(s) since a slot was found.", len(errors)
+                )
             self._checkout(slot)
-        except StopIteration as err:
-            raise NoSlotsAvailable(
-                f"No slots found for start_time={start}, lane={lane}, and target_date={target_date.date()}"
-            ) from err
+            return
+        if errors:
+            raise errors[0]
+
+        raise NoSlotsAvailable(
+            f"No slots found for start_time={start}, lane={lane}, and target_dates="
+            f"{', '.join(str(d.date()) for d in target_dates)}"
+        )
@@ -13,7 +13,7 @@ class Lane(Enum):
 
     @staticmethod
     def get(key: str) -> Lane:
-        try:
-            return Lane[key]
-        except KeyError:
-            return Lane.UNKNOWN
+        return _BY_NAME.get(key, Lane.UNKNOWN)
+
+
+_BY_NAME = {lane.name: lane for lane in Lane}
@@ -1,13 +1,16 @@
 import logging
 
+_FORMATTER = logging.Formatter(
+    "[{asctime}] {name:<37s} {levelname:<8s} - {message}", style="{"
+)
+_HANDLER = logging.StreamHandler()
+_HANDLER.setFormatter(_FORMATTER)
+
 
 def get_logger(name: str, module: str, level: int = logging.INFO) -> logging.Logger:
     logger = logging.getLogger(f"{module}.{name}")
-    logger.setLevel(level)
-    ch = logging.StreamHandler()
-    formatter = logging.Formatter(
-        "[{asctime}] {name:<37s} {levelname:<8s} - {message}", style="{"
-    )
-    ch.setFormatter(formatter)
-    logger.addHandler(ch)
+    if not logger.handlers:
+        logger.addHandler(_HANDLER)
+        logger.setLevel(level)
+        logger.propagate = False
     return logger
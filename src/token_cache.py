@@ -0,0 +1,65 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from src.log import get_logger
+
+DEFAULT_PATH = Path.home() / ".cache" / "nuffield-booker" / "token.json"
+DEFAULT_TTL = 12 * 60 * 60
+
+log = get_logger("TokenCache", __name__)
+
+
+class TokenCache(object):
+    """Persists the SSO auth token across runs so we can skip the login handshake"""
+
+    def __init__(self, path: Path = DEFAULT_PATH, ttl: int = DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+
+    def load(self, email: str) -> Optional[dict]:
+        """Returns the cached auth info for `email`, or None if there is no usable entry.
+
+        Entries are ignored if they have expired, belong to a different account, or if
+        the cache file is readable by anyone other than its owner.
+        """
+        try:
+            if self.path.stat().st_mode & 0o077 != 0:
+                return None
+            cached = json.loads(self.path.read_bytes())
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(cached, dict):
+            return None
+        if cached.get("email") != email or cached.get("expires_at", 0) <= time.time():
+            return None
+        return cached
+
+    def save(self, email: str, auth_token: str, member_id: int) -> None:
+        """Writes the auth info for `email`; failures are logged rather than raised."""
+        data = {
+            "email": email,
+            "auth_token": auth_token,
+            "member_id": member_id,
+            "expires_at": time.time() + self.ttl,
+        }
+        tmp_path = self.path.with_suffix(".tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning("Could not write token cache %s: %s", self.path, e)
+
+    def invalidate(self) -> None:
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning("Could not remove token cache %s: %s", self.path, e)
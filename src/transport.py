@@ -0,0 +1,100 @@
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+
+# Request extension that, when set to False, sends the request exactly once.
+RETRY_EXTENSION = "retry"
+
+# Failures after the request may have reached the server. Like urllib3's `Retry`,
+# these are only retried for idempotent methods, so a checkout is never sent twice.
+_READ_ERRORS = (httpx.ReadError, httpx.RemoteProtocolError)
+_IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"})
+
+
+class _RetryPolicy(object):
+    """Retry settings and back-off shared by the sync and async transports"""
+
+    def __init__(
+        self,
+        total: int = 5,
+        backoff_factor: float = 0.3,
+        status_forcelist: tuple = (429, 500, 502, 503, 504),
+        **kwargs,
+    ):
+        # Connect retries are done by the transports rather than via `retries`, so
+        # that they can be switched off per request too.
+        super().__init__(**kwargs)
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = status_forcelist
+
+    @staticmethod
+    def _is_retryable(request: httpx.Request, exc: httpx.TransportError) -> bool:
+        if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout)):
+            return True
+        return isinstance(exc, _READ_ERRORS) and request.method in _IDEMPOTENT_METHODS
+
+    def _backoff(self, attempt: int) -> float:
+        return 0 if attempt == 0 else self.backoff_factor * 2**attempt
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> Optional[float]:
+        if (value := response.headers.get("Retry-After")) is None:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+
+class RetryTransport(_RetryPolicy, httpx.HTTPTransport):
+    """HTTPTransport that retries connection failures and transient error statuses"""
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if not request.extensions.get(RETRY_EXTENSION, True):
+            return super().handle_request(request)
+
+        for attempt in range(self.total):
+            try:
+                response = super().handle_request(request)
+            except httpx.TransportError as e:
+                if not self._is_retryable(request, e):
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            if response.status_code not in self.status_forcelist:
+                return response
+            delay = self._retry_after(response)
+            response.close()
+            time.sleep(self._backoff(attempt) if delay is None else delay)
+        return super().handle_request(request)
+
+
+class AsyncRetryTransport(_RetryPolicy, httpx.AsyncHTTPTransport):
+    """AsyncHTTPTransport that retries connection failures and transient error statuses"""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not request.extensions.get(RETRY_EXTENSION, True):
+            return await super().handle_async_request(request)
+
+        for attempt in range(self.total):
+            try:
+                response = await super().handle_async_request(request)
+            except httpx.TransportError as e:
+                if not self._is_retryable(request, e):
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            if response.status_code not in self.status_forcelist:
+                return response
+            delay = self._retry_after(response)
+            await response.aclose()
+            await asyncio.sleep(self._backoff(attempt) if delay is None else delay)
+        return await super().handle_async_request(request)